@@ -1,32 +1,358 @@
+import time
+
+# Start of the cold-start time reported by /health/live, taken before the
+# Flask, psycopg2 and JWT imports below so their cost is included
+IMPORT_STARTED = time.perf_counter()
+
+import math
 import os
+import random
+import sqlite3
+import struct
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
 import psycopg2
-from flask import Flask, request, jsonify
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from flask import Blueprint, Flask, current_app, g, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
+    JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 )
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 from dotenv import load_dotenv
 from datetime import timedelta
 
 
-#     LOAD ENVIRONMENT     
-
-# Loads database connection details from a .env file (like DATABASE_URL)
-load_dotenv()
+#     CONFIGURATION     
+
+# Settings that must be present for the app to start
+REQUIRED_SETTINGS = ("JWT_SECRET_KEY", "DATABASE_URL")
+
+
+# Reads and validates the settings once, when create_app() runs
+def load_config():
+    # Loads database connection details from a .env file (like DATABASE_URL)
+    load_dotenv()
+
+    config = {
+        "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY"),
+        "JWT_ACCESS_TOKEN_EXPIRES": timedelta(days=1),
+        # Request bodies larger than this are rejected with a 413
+        "MAX_CONTENT_LENGTH": 1024 * 1024,
+        "DATABASE_URL": os.getenv("DATABASE_URL"),
+        # Connection attempts per use while the database is unreachable, and the
+        # base delay (doubled after each failed attempt) between them
+        "DB_CONNECT_RETRIES": int(os.getenv("DB_CONNECT_RETRIES", "3")),
+        "DB_CONNECT_BACKOFF_SECONDS": float(os.getenv("DB_CONNECT_BACKOFF_SECONDS", "0.5")),
+        "DB_CONNECT_TIMEOUT_SECONDS": int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "5")),
+        # After connecting fails, requests get a 503 straight away for this long
+        # instead of each running its own round of retries
+        "DB_DOWN_SECONDS": float(os.getenv("DB_DOWN_SECONDS", "5")),
+        # Requests allowed to use the database at once per worker. Each one gets its
+        # own primary connection from a pool of this size, and extra requests wait
+        # up to DB_QUEUE_TIMEOUT_SECONDS for a slot before getting a 503
+        "DB_MAX_CONCURRENCY": int(os.getenv("DB_MAX_CONCURRENCY", "8")),
+        "DB_QUEUE_TIMEOUT_SECONDS": float(os.getenv("DB_QUEUE_TIMEOUT_SECONDS", "2")),
+        # Optional comma separated list of replica DSNs for read-only routes, e.g.
+        # READ_REPLICA_URLS=postgres://replica1/db,postgres://replica2/db
+        "READ_REPLICA_URLS": [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()],
+        # Defaults to DB_MAX_CONCURRENCY so one replica can serve every admitted read
+        "REPLICA_POOL_SIZE": int(os.getenv("REPLICA_POOL_SIZE", os.getenv("DB_MAX_CONCURRENCY", "8"))),
+        "REPLICA_CONNECT_TIMEOUT_SECONDS": int(os.getenv("REPLICA_CONNECT_TIMEOUT_SECONDS", "2")),
+        # Replicas further behind the primary than this are skipped
+        "REPLICA_MAX_LAG_SECONDS": float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5")),
+        # How often each replica's lag (and liveness) is re-checked
+        "REPLICA_CHECK_INTERVAL_SECONDS": float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "2")),
+        # After a client writes, its reads stay on the primary for this long
+        "REPLICA_STICKY_SECONDS": float(os.getenv("REPLICA_STICKY_SECONDS", "10")),
+        # Set USE_PREPARED_STATEMENTS=0 to send plain SQL text instead (e.g. behind a
+        # transaction-pooling PgBouncer, or to compare timings with bench_prepared.py)
+        "USE_PREPARED_STATEMENTS": os.getenv("USE_PREPARED_STATEMENTS", "1") != "0",
+        # Set RATE_LIMIT_ENABLED=0 to turn off per-client token buckets
+        "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "1") != "0",
+        # "memory" (per worker) or "sqlite:///path/to/file.db" to share buckets
+        # between the workers on one host
+        "RATE_LIMIT_STORE": os.getenv("RATE_LIMIT_STORE", "memory"),
+    }
 
+    missing = [name for name in REQUIRED_SETTINGS if not config[name]]
+    if missing:
+        raise RuntimeError(f"Missing required settings: {', '.join(missing)}")
 
-#     INITIALIZE FLASK     
+    return config
 
-app = Flask(__name__)
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=1)
-jwt = JWTManager(app)
 
 #    DATABASE CONNECTION   
 
-# Connects to the PostgreSQL database using credentials from .env
-DATABASE_URL = os.getenv("DATABASE_URL")
-connection = psycopg2.connect(DATABASE_URL)
+# Runtime state of one app, kept in app.extensions so every create_app() gets its own
+class AppState:
+    def __init__(self):
+        # Pool of primary connections, one per admitted request; connects lazily
+        self.pool = None
+        # Monotonic time until which the primary is treated as unreachable
+        self.down_until = 0.0
+        # Read replicas from READ_REPLICA_URLS; their pools connect on first use
+        self.replicas = []
+        # Client key -> monotonic time until which its reads must go to the primary
+        self.sticky_clients = {}
+        self.sticky_swept_at = 0.0
+        # Tables created on the primary by this app (replicas are read-only)
+        self.ensured_tables = set()
+        # Admission control: token buckets and the database concurrency cap
+        self.token_buckets = None
+        self.db_slots = None
+
+
+def app_state():
+    return current_app.extensions["flask_api"]
+
+
+# Connects to the primary with exponential backoff and jitter. Gives up early once
+# another request has marked the primary down, and marks it down when out of attempts
+def connect_with_retry(config, retries, state):
+    delay = config["DB_CONNECT_BACKOFF_SECONDS"]
+    for attempt in range(retries + 1):
+        try:
+            return state.pool.getconn()
+        except psycopg2.OperationalError:
+            if attempt == retries or time.monotonic() < state.down_until:
+                state.down_until = time.monotonic() + config["DB_DOWN_SECONDS"]
+                raise
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+
+# Returns this request's primary connection, taken from the pool on first use and
+# handed back by release_connection(); while the primary is marked down, fails fast
+def get_connection(retries=None):
+    connection = g.get("db_connection")
+    if connection is not None and not connection.closed:
+        return connection
+
+    state = app_state()
+    if time.monotonic() < state.down_until:
+        raise psycopg2.OperationalError("Database marked unavailable after failed connection attempts")
+
+    config = current_app.config
+    connection = connect_with_retry(
+        config, config["DB_CONNECT_RETRIES"] if retries is None else retries, state
+    )
+    state.down_until = 0.0
+    g.db_connection = connection
+    return connection
+
+
+#    READ REPLICAS   
+
+# Replication lag in seconds, measured on the replica alone: NULL (unusable) when
+# it is not a replica or its WAL receiver is not streaming from the primary, 0 when
+# it has replayed everything received, else time since the last replayed transaction
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN NULL
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END;
+"""
+
+# Endpoints that write; a successful call pins the client's reads to the primary
+WRITE_ENDPOINTS = {
+    "api.upload_sensor_data", "api.handle_subadmins", "api.handle_subadmin_by_id",
+    "api.manage_vendor_clients", "api.handle_vendor_client", "api.register",
+}
+
+# Cookie that pins cookie-aware clients to the primary on every worker, not
+# just the one that handled their write
+STICKY_COOKIE = "read_primary"
+
+
+# ThreadedConnectionPool opens minconn connections up front and closes every
+# returned connection past minconn; this one starts empty and keeps up to maxconn
+# idle connections (and their prepared statements) for reuse
+class LazyConnectionPool(ThreadedConnectionPool):
+    def __init__(self, maxconn, *args, **kwargs):
+        super().__init__(0, maxconn, *args, **kwargs)
+        self.minconn = maxconn
+
+
+# A read replica with its own connection pool and cached health state
+class Replica:
+    def __init__(self, dsn, config):
+        self.dsn = dsn
+        self.pool_size = config["REPLICA_POOL_SIZE"]
+        self.connect_timeout = config["REPLICA_CONNECT_TIMEOUT_SECONDS"]
+        self.max_lag_seconds = config["REPLICA_MAX_LAG_SECONDS"]
+        self.check_interval_seconds = config["REPLICA_CHECK_INTERVAL_SECONDS"]
+        self.pool = None
+        self.healthy = False
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    # Re-checks a stale state; while another request is checking, use the last known one
+    def is_usable(self):
+        if time.monotonic() - self.checked_at >= self.check_interval_seconds:
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.healthy = self._check()
+                    self.checked_at = time.monotonic()
+                finally:
+                    self.lock.release()
+        return self.healthy
+
+    def _check(self):
+        conn = None
+        try:
+            if self.pool is None:
+                self.pool = LazyConnectionPool(
+                    self.pool_size, self.dsn, connect_timeout=self.connect_timeout
+                )
+            conn = self.pool.getconn()
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(REPLICA_LAG_QUERY)
+                    lag = cursor.fetchone()[0]
+            self.pool.putconn(conn)
+            return lag is not None and lag <= self.max_lag_seconds
+        except PoolError:
+            # Every connection is busy serving reads: busy, not broken
+            return self.healthy
+        except psycopg2.Error:
+            if conn is not None:
+                self.pool.putconn(conn, close=True)
+            return False
+# A replica connection broke mid-request; replica_fallback retries the read on the primary
+class ReplicaFailed(Exception):
+    pass
+
+
+# device_id of the (first) reading in the request body
+def device_key():
+    if request.mimetype == SENSOR_FRAME_MIMETYPE:
+        payload = request.get_data()
+        if len(payload) >= SENSOR_FRAME.size:
+            return SENSOR_FRAME.unpack_from(payload)[0].rstrip(b"\0").decode("utf-8", "replace")
+        return None
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get("device_id"):
+        return str(data["device_id"])
+    return None
+
+
+# JWT identity if this request's token has been verified, else None
+def current_jwt_identity():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+# Who a request belongs to for read-your-writes: device, then JWT identity, then IP
+def sticky_key():
+    device_id = (request.view_args or {}).get("device_id")
+    if device_id is None and request.method not in ("GET", "HEAD", "OPTIONS"):
+        device_id = device_key()
+    if device_id:
+        return f"device:{device_id}"
+    identity = current_jwt_identity()
+    if identity:
+        return f"user:{identity}"
+    return f"ip:{request.remote_addr}"
+
+
+def mark_client_wrote(response):
+    state = app_state()
+    now = time.monotonic()
+    sticky_seconds = current_app.config["REPLICA_STICKY_SECONDS"]
+    state.sticky_clients[sticky_key()] = now + sticky_seconds
+    response.set_cookie(
+        STICKY_COOKIE, "1", max_age=int(math.ceil(sticky_seconds)), httponly=True, samesite="Lax"
+    )
+
+    # Drop expired entries at most once per sticky window
+    if now - state.sticky_swept_at >= sticky_seconds:
+        state.sticky_swept_at = now
+        for key, until in list(state.sticky_clients.items()):
+            if until < now:
+                state.sticky_clients.pop(key, None)
+
+
+def is_client_sticky():
+    if g.get("read_from_primary") or STICKY_COOKIE in request.cookies:
+        return True
+    sticky_clients = app_state().sticky_clients
+    key = sticky_key()
+    until = sticky_clients.get(key)
+    if until is None:
+        return False
+    if until < time.monotonic():
+        sticky_clients.pop(key, None)
+        return False
+    return True
+
+
+# Re-runs a read-only view on the primary if its replica connection breaks
+def replica_fallback(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except ReplicaFailed:
+            g.read_from_primary = True
+            return view(*args, **kwargs)
+    return wrapper
+
+
+# Connection for a read-only query: a healthy, caught-up replica if there is one,
+# else the primary (also used right after this client wrote, for read-your-writes)
+@contextmanager
+def read_connection():
+    replicas = app_state().replicas
+    if not replicas or is_client_sticky():
+        with get_connection() as connection:
+            yield connection
+        return
+
+    for replica in random.sample(replicas, len(replicas)):
+        if not replica.is_usable():
+            continue
+        try:
+            conn = replica.pool.getconn()
+        except PoolError:
+            # Pool exhausted: the replica is busy, not down; try the next one
+            continue
+        except psycopg2.Error:
+            replica.healthy = False
+            continue
+        try:
+            with conn:
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+            if conn.closed:
+                replica.healthy = False
+            raise ReplicaFailed() from error
+        finally:
+            replica.pool.putconn(conn, close=bool(conn.closed))
+        return
+
+    with get_connection() as connection:
+        yield connection
+
+
+# Runs a CREATE TABLE IF NOT EXISTS on the primary once per app
+def ensure_table(create_sql):
+    ensured_tables = app_state().ensured_tables
+    if create_sql in ensured_tables:
+        return
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(create_sql)
+    ensured_tables.add(create_sql)
 
 
 # CREATE SENSOR DATA TABLE 
@@ -51,6 +377,61 @@ VALUES (%s, %s, %s, %s, %s)
 RETURNING id;
 """
 
+GET_ALL_SENSOR_DATA = "SELECT device_id, temperature, humidity, soil_moisture, ph, timestamp FROM demo;"
+
+GET_LATEST_SENSOR_DATA = """
+SELECT id, device_id, temperature, humidity, soil_moisture, ph, timestamp
+FROM demo
+WHERE device_id = %s
+ORDER BY timestamp DESC
+LIMIT 1;
+"""
+
+# Multi-row variant used by the binary frame upload (rows filled in by execute_values)
+INSERT_SENSOR_DATA_BATCH_RETURN_ID = """
+INSERT INTO demo (device_id, temperature, humidity, soil_moisture, ph)
+VALUES %s
+RETURNING id;
+"""
+
+
+# BINARY SENSOR FRAME FORMAT
+
+# Compact alternative to JSON for constrained field devices. The request body is
+# one or more fixed-size records packed back to back, each laid out as:
+#   device_id      16 bytes, UTF-8, NUL padded
+#   temperature    float32, little-endian
+#   humidity       float32, little-endian
+#   soil_moisture  float32, little-endian
+#   ph             float32, little-endian
+# 32 bytes per reading versus roughly 100 bytes for the equivalent JSON object
+# (see bench_ingest.py).
+SENSOR_FRAME_MIMETYPE = "application/x-sensor-frame"
+SENSOR_FRAME = struct.Struct("<16s4f")
+
+# Readings accepted in one request, so one device cannot tie up the database
+# with a huge insert
+MAX_SENSOR_FRAMES = 500
+
+
+# Unpacks a binary payload straight from a memoryview into rows for the batch
+# insert. Returns None for an empty or truncated payload, or a blank / non UTF-8 device_id.
+def decode_sensor_frames(payload):
+    if not payload or len(payload) % SENSOR_FRAME.size:
+        return None
+
+    rows = []
+    for raw_id, temperature, humidity, soil_moisture, ph in SENSOR_FRAME.iter_unpack(memoryview(payload)):
+        try:
+            device_id = raw_id.rstrip(b"\0").decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        if not device_id:
+            return None
+        rows.append((device_id, temperature, humidity, soil_moisture, ph))
+    return rows
+
+
 # CREATE TABLE FOR CROP HISTORY
 CREATE_CROP_HISTORY_TABLE = """
 CREATE TABLE IF NOT EXISTS crop_history (
@@ -64,6 +445,16 @@ CREATE TABLE IF NOT EXISTS crop_history (
 );
 """
 
+GET_CROP_HISTORY_BY_ID = """
+SELECT id, device_id, crop, year, region, yield_per_hectare, area_hectare
+FROM crop_history WHERE id = %s;
+"""
+
+GET_CROP_HISTORY_BY_DEVICE = """
+SELECT id, device_id, crop, year, region, yield_per_hectare, area_hectare
+FROM crop_history WHERE device_id = %s;
+"""
+
 # CREATE ALERTS TABLE
 CREATE_ALERTS_TABLE = """
 CREATE TABLE IF NOT EXISTS alerts (
@@ -75,6 +466,13 @@ CREATE TABLE IF NOT EXISTS alerts (
 );
 """
 
+# Group and count alerts by type
+GET_ALERT_SUMMARY = """
+SELECT alert_type, COUNT(*) q1
+FROM alerts
+GROUP BY alert_type;
+"""
+
 
 # SQL Queries
 CREATE_SUBADMINS_TABLE = """
@@ -146,13 +544,285 @@ CREATE TABLE IF NOT EXISTS users (
 );
 """
 
+INSERT_USER_RETURN_ID = "INSERT INTO users (username, email, password_hash, role) VALUES (%s, %s, %s, %s) RETURNING id;"
+
+GET_USER_BY_EMAIL = "SELECT id, username, password_hash, role FROM users WHERE email = %s;"
+
+GET_USER_PROFILE_BY_ID = "SELECT id, username, email, role FROM users WHERE id = %s;"
+
+GET_USER_ROLE_BY_ID = "SELECT username, role FROM users WHERE id = %s;"
+
+
+#   PREPARED STATEMENTS   
+
+# Constants that are not single statements with %s parameters
+UNPREPARED_STATEMENTS = {"INSERT_SENSOR_DATA_BATCH_RETURN_ID"}
+
+
+# Turns a %s-style SQL constant into its PREPARE and EXECUTE text
+def build_statement(name, sql):
+    parts = sql.strip().rstrip(";").split("%s")
+    body = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+    statement_name = name.lower()
+    prepare_sql = f"PREPARE {statement_name} AS {body};"
+    if len(parts) > 1:
+        execute_sql = f"EXECUTE {statement_name} ({', '.join(['%s'] * (len(parts) - 1))});"
+    else:
+        execute_sql = f"EXECUTE {statement_name};"
+    return prepare_sql, execute_sql
+
+
+# Constant name -> (PREPARE sql, EXECUTE sql), built from the SQL constants above
+STATEMENTS = {
+    name: build_statement(name, value)
+    for name, value in list(globals().items())
+    if name.startswith(("GET_", "INSERT_", "UPDATE_", "DELETE_"))
+    and isinstance(value, str)
+    and name not in UNPREPARED_STATEMENTS
+}
+
+# Connection -> names of statements already prepared in its session. Keyed
+# weakly so a reconnected (new) connection starts empty and re-prepares.
+prepared_statements = weakref.WeakKeyDictionary()
+prepare_lock = threading.Lock()
+
+
+# Executes a registered SQL constant by name. It is PREPAREd the first time it is
+# used on a connection; after that only EXECUTE and the parameters are sent
+def execute_prepared(cursor, name, params=()):
+    if not current_app.config["USE_PREPARED_STATEMENTS"]:
+        cursor.execute(globals()[name], params)
+        return
+
+    prepare_sql, execute_sql = STATEMENTS[name]
+    conn = cursor.connection
+    prepared = prepared_statements.get(conn)
+    if prepared is None or name not in prepared:
+        # The lock covers only the bookkeeping and PREPARE, never the query itself
+        with prepare_lock:
+            prepared = prepared_statements.setdefault(conn, set())
+            if name not in prepared:
+                cursor.execute(prepare_sql)
+                prepared.add(name)
+
+    try:
+        cursor.execute(execute_sql, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The session lost its statements (e.g. DISCARD ALL); prepare again next time
+        prepared.clear()
+        raise
+
+
+#   ADMISSION CONTROL   
+
+# Endpoint -> (tokens refilled per second, bucket size) for each client.
+# Ingest is limited per device, everything else per JWT identity or IP.
+ROUTE_RATE_LIMITS = {
+    "api.upload_sensor_data": (1, 10),
+    "api.trigger_irrigation": (1, 5),
+    "api.sensors_data": (0.5, 5),
+    "api.handle_subadmins": (2, 10),
+    "api.manage_vendor_clients": (2, 10),
+    "api.register": (0.2, 5),
+    "api.login": (0.5, 10),
+}
+DEFAULT_RATE_LIMIT = (10, 40)
+
+# Endpoints keyed by the device_id in the request body
+DEVICE_KEYED_ENDPOINTS = {"api.upload_sensor_data", "api.trigger_irrigation"}
+
+# Extra per-IP bucket on device-keyed endpoints, so a client cannot dodge its
+# limit by sending a new device_id each time. Generous, as one gateway or NAT
+# address may front many devices.
+DEVICE_ENDPOINT_IP_RATE_LIMIT = (20, 100)
+
+# Longest time any bucket takes to refill from empty
+MAX_REFILL_SECONDS = max(
+    burst / rate
+    for rate, burst in [*ROUTE_RATE_LIMITS.values(), DEFAULT_RATE_LIMIT, DEVICE_ENDPOINT_IP_RATE_LIMIT]
+)
+
+# Endpoints that never touch the database skip the concurrency cap
+NO_DB_ENDPOINTS = {
+    "api.home", "api.trigger_irrigation", "api.get_market_prices",
+    "api.get_crop_history", "api.logout", "api.liveness",
+}
+
+# Endpoints that are never rate limited (orchestrator probes)
+UNLIMITED_ENDPOINTS = {"api.liveness", "api.readiness"}
+
+
+# Token buckets kept in this worker's memory, evicting the least recently used
+# bucket once there are more than MAX_BUCKETS
+class MemoryTokenBuckets:
+    MAX_BUCKETS = 100_000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Takes one token; returns 0 if allowed, else seconds until one is available
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+# Token buckets in a local SQLite file, shared by every worker on the host. Fails
+# open: if the file is locked or broken, the request is admitted.
+class SqliteTokenBuckets:
+    # How long to wait on another worker's lock before admitting the request
+    BUSY_TIMEOUT_SECONDS = 0.01
+    # How often each worker deletes buckets idle long enough to have refilled
+    PRUNE_INTERVAL_SECONDS = 60
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.pruned_at = time.monotonic()
+        db = sqlite3.connect(path)
+        try:
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL);")
+            db.commit()
+        finally:
+            db.close()
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            # Bucket state is disposable, so skip fsync on every update
+            db.execute("PRAGMA synchronous=OFF;")
+            self.local.db = db
+        return db
+
+    # Takes one token; returns 0 if allowed, else seconds until one is available
+    def take(self, key, rate, burst):
+        now = time.time()
+        try:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE;")
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?;", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?);",
+                (key, tokens, now),
+            )
+            if time.monotonic() - self.pruned_at >= self.PRUNE_INTERVAL_SECONDS:
+                self.pruned_at = time.monotonic()
+                db.execute("DELETE FROM buckets WHERE updated < ?;", (now - MAX_REFILL_SECONDS,))
+            db.execute("COMMIT;")
+        except sqlite3.Error:
+            self._rollback()
+            return 0
+        return wait
+
+    def _rollback(self):
+        db = getattr(self.local, "db", None)
+        try:
+            if db is not None and db.in_transaction:
+                db.execute("ROLLBACK;")
+        except sqlite3.Error:
+            # Start over with a fresh connection on the next request
+            db.close()
+            self.local.db = None
+
+
+def make_token_buckets(store):
+    if store == "memory":
+        return MemoryTokenBuckets()
+    if store.startswith("sqlite:///"):
+        return SqliteTokenBuckets(store[len("sqlite:///"):])
+    raise RuntimeError(f"Unsupported RATE_LIMIT_STORE: {store}")
+
+
+# Identifies the caller: device for ingest, then JWT identity, then IP address
+def client_key(endpoint):
+    if endpoint in DEVICE_KEYED_ENDPOINTS:
+        device_id = device_key()
+        if device_id:
+            return f"device:{device_id}"
+    if "Authorization" in request.headers:
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except (JWTExtendedException, PyJWTError):
+            identity = None
+        if identity:
+            return f"user:{identity}"
+    return f"ip:{request.remote_addr}"
+
+
+def too_busy(message, retry_after, status):
+    return {"error": message}, status, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+#     ROUTES     
+
+# All endpoints live on this blueprint; create_app() registers it
+api = Blueprint("api", __name__)
+jwt = JWTManager()
+
+
+# Rate limit the client, then queue for a database slot, before any handler runs
+@api.before_request
+def admit_request():
+    state = app_state()
+    endpoint = request.endpoint
+    if state.token_buckets is not None and endpoint not in UNLIMITED_ENDPOINTS:
+        rate, burst = ROUTE_RATE_LIMITS.get(endpoint, DEFAULT_RATE_LIMIT)
+        wait = state.token_buckets.take(f"{endpoint}|{client_key(endpoint)}", rate, burst)
+        if not wait and endpoint in DEVICE_KEYED_ENDPOINTS:
+            rate, burst = DEVICE_ENDPOINT_IP_RATE_LIMIT
+            wait = state.token_buckets.take(f"{endpoint}|ip:{request.remote_addr}", rate, burst)
+        if wait:
+            return too_busy("Too many requests, slow down", wait, 429)
+
+    if endpoint not in NO_DB_ENDPOINTS:
+        if not state.db_slots.acquire(timeout=current_app.config["DB_QUEUE_TIMEOUT_SECONDS"]):
+            return too_busy("Server busy, please retry later", 1, 503)
+        g.holds_db_slot = True
+
+
+# Hands the request's primary connection back to the pool, then frees its slot
+@api.teardown_request
+def release_connection(error):
+    connection = g.pop("db_connection", None)
+    if connection is not None:
+        app_state().pool.putconn(connection, close=bool(connection.closed))
+    if g.pop("holds_db_slot", False):
+        app_state().db_slots.release()
+
+
+# Any successful write pins the client's following reads to the primary
+@api.after_app_request
+def track_writes(response):
+    if (app_state().replicas and request.endpoint in WRITE_ENDPOINTS
+            and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400):
+        mark_client_wrote(response)
+    return response
+
 
 # HOME ROUTE        
 
-@app.route("/")
+@api.route("/")
 def home():
     return jsonify({
         "UPLOAD SENSOR DATA API": {"url": "/api/demo/upload", "method": "POST"},
+        "UPLOAD SENSOR DATA (BINARY FRAMES)": {"url": "/api/demo/upload", "method": "POST", "content_type": SENSOR_FRAME_MIMETYPE},
         "GET ALL SENSOR TABLE DATA": {"url": "/all-data", "method": "GET"},
         "GET LATEST SENSOR DATA FOR DEVICE": {"url": "/api/demo/latest/<device_id>", "method": "GET"},
         "IRRIGATION TRIGGER LOGIC": {"url": "/api/irrigation/trigger", "method": "POST"},
@@ -175,9 +845,13 @@ def home():
 
 #     UPLOAD SENSOR DATA API    
 
-@app.post("/api/demo/upload")
+@api.post("/api/demo/upload")
 def upload_sensor_data():
-    # Expect JSON input with sensor values
+    # Binary frames carry one or many readings and go straight to the batch insert
+    if request.mimetype == SENSOR_FRAME_MIMETYPE:
+        return upload_sensor_frames()
+
+    # Otherwise expect JSON input with sensor values
     data = request.get_json()
     required_fields = ['device_id', 'temperature', 'humidity', 'soil_moisture', 'ph']
 
@@ -193,12 +867,14 @@ def upload_sensor_data():
     soil_moisture = data["soil_moisture"]
     ph = data["ph"]
 
+    ensure_table(CREATE_SENSOR_TABLE)  # Ensure table exists
+
     # Insert into database
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
-            cursor.execute(CREATE_SENSOR_TABLE)  # Ensure table exists
-            cursor.execute(
-                INSERT_SENSOR_DATA_RETURN_ID,
+            execute_prepared(
+                cursor,
+                "INSERT_SENSOR_DATA_RETURN_ID",
                 (device_id, temperature, humidity, soil_moisture, ph)
             )
             sensor_id = cursor.fetchone()[0]
@@ -206,14 +882,41 @@ def upload_sensor_data():
     return jsonify({"id": sensor_id, "message": "Sensor data uploaded successfully"}), 201
 
 
+def upload_sensor_frames():
+    max_bytes = MAX_SENSOR_FRAMES * SENSOR_FRAME.size
+    if request.content_length is not None and request.content_length > max_bytes:
+        return {"error": f"At most {MAX_SENSOR_FRAMES} sensor frames per request"}, 413
+
+    payload = request.get_data()
+    if len(payload) > max_bytes:
+        return {"error": f"At most {MAX_SENSOR_FRAMES} sensor frames per request"}, 413
+
+    rows = decode_sensor_frames(payload)
+    if rows is None:
+        return {"error": f"Body must be one or more {SENSOR_FRAME.size}-byte sensor frames"}, 400
+
+    ensure_table(CREATE_SENSOR_TABLE)  # Ensure table exists
+
+    # Insert every reading in a single statement
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            result = execute_values(
+                cursor, INSERT_SENSOR_DATA_BATCH_RETURN_ID, rows, page_size=len(rows), fetch=True
+            )
+
+    sensor_ids = [row[0] for row in result]
+    return jsonify({"ids": sensor_ids, "message": f"{len(sensor_ids)} sensor readings uploaded successfully"}), 201
+
+
 #   GET ALL SENSOR DATA (with timestamp) 
 
-@app.get("/all-data")
+@api.get("/all-data")
+@replica_fallback
 def sensors_data():
     # Fetch all data from 'demo' table
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT device_id, temperature, humidity, soil_moisture, ph, timestamp FROM demo;")
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_ALL_SENSOR_DATA")
             rows = cursor.fetchall()
 
     # Format data as list of dictionaries
@@ -231,19 +934,12 @@ def sensors_data():
 
 # GET LATEST SENSOR DATA FOR A DEVICE (latest only)
 
-@app.get("/api/demo/latest/<device_id>")
+@api.get("/api/demo/latest/<device_id>")
+@replica_fallback
 def get_latest_sensor_data(device_id):
-    SELECT_LATEST_SENSOR_DATA = """
-    SELECT id, device_id, temperature, humidity, soil_moisture, ph, timestamp
-    FROM demo
-    WHERE device_id = %s
-    ORDER BY timestamp DESC
-    LIMIT 1;
-    """
-
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(SELECT_LATEST_SENSOR_DATA, (device_id,))
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_LATEST_SENSOR_DATA", (device_id,))
             result = cursor.fetchone()
 
             if result is None:
@@ -264,7 +960,7 @@ def get_latest_sensor_data(device_id):
 
 #  IRRIGATION TRIGGER LOGIC BASED ON DATA  
 
-@app.post("/api/irrigation/trigger")
+@api.post("/api/irrigation/trigger")
 def trigger_irrigation():
     # Expect JSON input
     data = request.get_json()
@@ -301,7 +997,7 @@ def trigger_irrigation():
 
 #     MARKET PRICE API (MOCKED)     
 
-@app.get("/api/market/prices")
+@api.get("/api/market/prices")
 def get_market_prices():
     crop = request.args.get("crop", "").lower()
     region = request.args.get("region", "").lower()
@@ -332,7 +1028,7 @@ def get_market_prices():
 
 #   HISTORICAL CROP DATA API (STATIC)     
 
-@app.get("/api/crop/history")
+@api.get("/api/crop/history")
 def get_crop_history():
     crop = request.args.get("crop", "").lower()
 
@@ -366,12 +1062,14 @@ def get_crop_history():
 
 
 # GET CROP HISTORY BY ID
-@app.get("/api/crop/history/<int:id>")
+@api.get("/api/crop/history/<int:id>")
+@replica_fallback
 def get_crop_history_by_id(id):
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(CREATE_CROP_HISTORY_TABLE)  # Ensure table exists
-            cursor.execute("SELECT * FROM crop_history WHERE id = %s;", (id,))
+    ensure_table(CREATE_CROP_HISTORY_TABLE)  # Ensure table exists
+
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_CROP_HISTORY_BY_ID", (id,))
             row = cursor.fetchone()
 
     if row:
@@ -390,12 +1088,14 @@ def get_crop_history_by_id(id):
 
 
 # GET CROP HISTORY BY DEVICE_ID
-@app.get("/api/crop/history/device/<device_id>")
+@api.get("/api/crop/history/device/<device_id>")
+@replica_fallback
 def get_crop_history_by_device(device_id):
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(CREATE_CROP_HISTORY_TABLE)  # Ensure table exists
-            cursor.execute("SELECT * FROM crop_history WHERE device_id = %s;", (device_id,))
+    ensure_table(CREATE_CROP_HISTORY_TABLE)  # Ensure table exists
+
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_CROP_HISTORY_BY_DEVICE", (device_id,))
             rows = cursor.fetchall()
 
     if not rows:
@@ -416,19 +1116,16 @@ def get_crop_history_by_device(device_id):
     return jsonify(data), 200
 
 
-@app.get("/api/alerts/summary")
+@api.get("/api/alerts/summary")
+@replica_fallback
 def alert_summary():
-    with connection:
-        with connection.cursor() as cursor:
-            # Ensure the alerts table exists
-            cursor.execute(CREATE_ALERTS_TABLE)
+    # Ensure the alerts table exists
+    ensure_table(CREATE_ALERTS_TABLE)
 
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
             # Group and count alerts by type
-            cursor.execute("""
-                SELECT alert_type, COUNT(*) q1
-                FROM alerts 
-                GROUP BY alert_type;
-            """)
+            execute_prepared(cursor, "GET_ALERT_SUMMARY")
             rows = cursor.fetchall()
 
     summary = [{"alert_type": row[0], "count": row[1]} for row in rows]
@@ -437,9 +1134,9 @@ def alert_summary():
 
 
 # Flask route for /api/admin/subadmins
-@app.route("/api/admin/subadmins", methods=["GET", "POST"])
+@api.route("/api/admin/subadmins", methods=["GET", "POST"])
 def handle_subadmins():
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
             cursor.execute(CREATE_SUBADMINS_TABLE)
 
@@ -454,7 +1151,7 @@ def handle_subadmins():
                     return {"error": "All fields (name, email, role, phone) are required."}, 400
 
                 try:
-                    cursor.execute(INSERT_SUBADMIN, (name, email, role, phone))
+                    execute_prepared(cursor, "INSERT_SUBADMIN", (name, email, role, phone))
                     subadmin_id = cursor.fetchone()[0]
                     return {
                         "id": subadmin_id,
@@ -464,7 +1161,7 @@ def handle_subadmins():
                     return {"error": "Email already exists."}, 409
 
             # GET all subadmins
-            cursor.execute(GET_ALL_SUBADMINS)
+            execute_prepared(cursor, "GET_ALL_SUBADMINS")
             rows = cursor.fetchall()
             subadmins = [{
                 "id": row[0],
@@ -479,12 +1176,12 @@ def handle_subadmins():
 
 
 # Flask route for /api/admin/subadmins/<id>
-@app.route("/api/admin/subadmins/<int:id>", methods=["GET", "PUT", "DELETE"])
+@api.route("/api/admin/subadmins/<int:id>", methods=["GET", "PUT", "DELETE"])
 def handle_subadmin_by_id(id):
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
             if request.method == "GET":
-                cursor.execute(GET_SUBADMIN_BY_ID, (id,))
+                execute_prepared(cursor, "GET_SUBADMIN_BY_ID", (id,))
                 row = cursor.fetchone()
                 if not row:
                     return {"error": "Subadmin not found."}, 404
@@ -509,19 +1206,19 @@ def handle_subadmin_by_id(id):
                 if not name or not email or not role or not phone:
                     return {"error": "All fields (name, email, role, phone) are required."}, 400
 
-                cursor.execute(UPDATE_SUBADMIN, (name, email, role, phone, id))
+                execute_prepared(cursor, "UPDATE_SUBADMIN", (name, email, role, phone, id))
                 return {"message": f"Subadmin ID {id} updated successfully."}, 200
 
             elif request.method == "DELETE":
-                cursor.execute(DELETE_SUBADMIN, (id,))
+                execute_prepared(cursor, "DELETE_SUBADMIN", (id,))
                 return {"message": f"Subadmin ID {id} deleted successfully."}, 200
 
 
 
 # Endpoint: /api/vendor/clients
-@app.route("/api/vendor/clients", methods=["GET", "POST"])
+@api.route("/api/vendor/clients", methods=["GET", "POST"])
 def manage_vendor_clients():
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
             cursor.execute(CREATE_VENDOR_CLIENTS_TABLE)
 
@@ -536,7 +1233,7 @@ def manage_vendor_clients():
                     return {"error": "All fields (name, email, phone, address) are required."}, 400
 
                 try:
-                    cursor.execute(INSERT_VENDOR_CLIENT_RETURN_ID, (name, email, phone, address))
+                    execute_prepared(cursor, "INSERT_VENDOR_CLIENT_RETURN_ID", (name, email, phone, address))
                     client_id = cursor.fetchone()[0]
                     return {
                         "id": client_id,
@@ -546,7 +1243,7 @@ def manage_vendor_clients():
                     return {"error": "Email already exists"}, 409
 
             # GET all clients
-            cursor.execute(GET_ALL_VENDOR_CLIENTS)
+            execute_prepared(cursor, "GET_ALL_VENDOR_CLIENTS")
             rows = cursor.fetchall()
             clients = [{
                 "id": row[0],
@@ -561,13 +1258,13 @@ def manage_vendor_clients():
 
 
 # Endpoint: /api/vendor/clients/<id>
-@app.route("/api/vendor/clients/<int:id>", methods=["GET", "PUT", "DELETE"])
+@api.route("/api/vendor/clients/<int:id>", methods=["GET", "PUT", "DELETE"])
 def handle_vendor_client(id):
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
             # GET client by ID
             if request.method == "GET":
-                cursor.execute(GET_VENDOR_CLIENT_BY_ID, (id,))
+                execute_prepared(cursor, "GET_VENDOR_CLIENT_BY_ID", (id,))
                 row = cursor.fetchone()
                 if row is None:
                     return {"error": "Vendor client not found"}, 404
@@ -593,15 +1290,15 @@ def handle_vendor_client(id):
                 if not name or not email:
                     return {"error": "Name and email are required"}, 400
 
-                cursor.execute(UPDATE_VENDOR_CLIENT, (name, email, phone, address, id))
+                execute_prepared(cursor, "UPDATE_VENDOR_CLIENT", (name, email, phone, address, id))
                 return {"message": f"Vendor client {id} updated successfully"}, 200
 
             # DELETE: Remove client
             elif request.method == "DELETE":
-                cursor.execute(DELETE_VENDOR_CLIENT, (id,))
+                execute_prepared(cursor, "DELETE_VENDOR_CLIENT", (id,))
                 return {"message": f"Vendor client {id} deleted successfully"}, 200
 
-@app.post("/api/auth/register")
+@api.post("/api/auth/register")
 def register():
     data = request.get_json()
     username = data.get("username")
@@ -614,12 +1311,13 @@ def register():
 
     hashed_password = generate_password_hash(password)
 
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
             cursor.execute(CREATE_USERS_TABLE)
             try:
-                cursor.execute(
-                    "INSERT INTO users (username, email, password_hash, role) VALUES (%s, %s, %s, %s) RETURNING id;",
+                execute_prepared(
+                    cursor,
+                    "INSERT_USER_RETURN_ID",
                     (username, email, hashed_password, role)
                 )
                 user_id = cursor.fetchone()[0]
@@ -630,7 +1328,7 @@ def register():
 
 #  Login
 
-@app.post("/api/auth/login")
+@api.post("/api/auth/login")
 def login():
     data = request.get_json()
     email = data.get("email")
@@ -639,9 +1337,9 @@ def login():
     if not email or not password:
         return {"error": "Email and password are required"}, 400
 
-    with connection:
+    with get_connection() as connection:
         with connection.cursor() as cursor:
-            cursor.execute("SELECT id, username, password_hash, role FROM users WHERE email = %s;", (email,))
+            execute_prepared(cursor, "GET_USER_BY_EMAIL", (email,))
             user = cursor.fetchone()
 
             if user and check_password_hash(user[2], password):
@@ -656,7 +1354,7 @@ def login():
 
 #  Logout (Mock)
 
-@app.post("/api/auth/logout")
+@api.post("/api/auth/logout")
 @jwt_required()
 def logout():
     user_id = get_jwt_identity()
@@ -664,14 +1362,15 @@ def logout():
 
 #  Get Profile
 
-@app.get("/api/profile")
+@api.get("/api/profile")
 @jwt_required()
+@replica_fallback
 def get_profile():
     user_id = get_jwt_identity()  # string user ID from token
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT id, username, email, role FROM users WHERE id = %s;", (user_id,))
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_USER_PROFILE_BY_ID", (user_id,))
             user = cursor.fetchone()
 
             if not user:
@@ -686,14 +1385,15 @@ def get_profile():
 
 #  Admin Dashboard
 
-@app.get("/api/admin/dashboard")
+@api.get("/api/admin/dashboard")
 @jwt_required()
+@replica_fallback
 def admin_dashboard():
     user_id = get_jwt_identity()
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT username, role FROM users WHERE id = %s;", (user_id,))
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_USER_ROLE_BY_ID", (user_id,))
             user = cursor.fetchone()
 
             if not user:
@@ -706,14 +1406,15 @@ def admin_dashboard():
             return {"message": f"Welcome Admin {username}"}, 200
 
 
-@app.get("/api/ventor/dashboard")
+@api.get("/api/ventor/dashboard")
 @jwt_required()
+@replica_fallback
 def ventor_dashboard():
     user_id = get_jwt_identity()
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT username, role FROM users WHERE id = %s;", (user_id,))
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_USER_ROLE_BY_ID", (user_id,))
             user = cursor.fetchone()
 
             if not user:
@@ -726,14 +1427,15 @@ def ventor_dashboard():
             return {"message": f"Welcome ventor {username}"}, 200
 
 
-@app.get("/api/users/dashboard")
+@api.get("/api/users/dashboard")
 @jwt_required()
+@replica_fallback
 def users_dashboard():
     user_id = get_jwt_identity()
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT username, role FROM users WHERE id = %s;", (user_id,))
+    with read_connection() as conn:
+        with conn.cursor() as cursor:
+            execute_prepared(cursor, "GET_USER_ROLE_BY_ID", (user_id,))
             user = cursor.fetchone()
 
             if not user:
@@ -746,7 +1448,63 @@ def users_dashboard():
             return {"message": f"Welcome user {username}"}, 200
 
 
+#     HEALTH CHECKS     
+
+# Liveness: the process is up and serving; never touches the database
+@api.get("/health/live")
+def liveness():
+    return {"status": "ok", "startup_seconds": current_app.config["STARTUP_SECONDS"]}, 200
+
+
+# Readiness: the primary database is reachable (a single attempt, no backoff)
+@api.get("/health/ready")
+def readiness():
+    try:
+        with get_connection(retries=0) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+    except psycopg2.OperationalError:
+        return {"status": "unavailable", "database": "down"}, 503
+
+    return {"status": "ready", "database": "up"}, 200
+
+
+# Database outages surface as 503s instead of crashing the request with a 500
+@api.app_errorhandler(psycopg2.OperationalError)
+def database_unavailable(error):
+    return {"error": "Database unavailable, please retry later"}, 503
+
+
+#     INITIALIZE FLASK     
+
+# Application factory: validates the configuration and wires up the routes. No
+# database connection is opened here (pools start empty), so the app starts even
+# while the database is unreachable
+def create_app():
+    app = Flask(__name__)
+    app.config.update(load_config())
+    jwt.init_app(app)
+    app.register_blueprint(api)
+
+    state = AppState()
+    # Sized to the concurrency cap, so an admitted request always gets a connection
+    state.pool = LazyConnectionPool(
+        app.config["DB_MAX_CONCURRENCY"], app.config["DATABASE_URL"],
+        connect_timeout=app.config["DB_CONNECT_TIMEOUT_SECONDS"],
+    )
+    if app.config["RATE_LIMIT_ENABLED"]:
+        state.token_buckets = make_token_buckets(app.config["RATE_LIMIT_STORE"])
+    state.db_slots = threading.BoundedSemaphore(app.config["DB_MAX_CONCURRENCY"])
+    state.replicas = [Replica(dsn, app.config) for dsn in app.config["READ_REPLICA_URLS"]]
+    app.extensions["flask_api"] = state
+
+    # Cold start reported by /health/live: from the start of importing app.py to the
+    # end of this factory (interpreter and WSGI server boot are not included)
+    app.config["STARTUP_SECONDS"] = round(time.perf_counter() - IMPORT_STARTED, 6)
+    return app
+
+
 # RUN THE SERVER       
 
 if __name__ == "__main__":
-    app.run(port=8080, debug=True)
+    create_app().run(port=8080, debug=True)
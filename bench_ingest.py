@@ -0,0 +1,62 @@
+import json
+import struct
+import sys
+import timeit
+
+
+#   INGEST BENCHMARK: JSON vs BINARY SENSOR FRAMES
+
+# Compares the bytes on the wire and the server-side parse time of the JSON
+# upload body against the binary frame body accepted by /api/demo/upload.
+# Needs no database. Usage: python bench_ingest.py [readings] > bench_output.txt
+
+# Same layout as SENSOR_FRAME in app.py
+SENSOR_FRAME = struct.Struct("<16s4f")
+
+READINGS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+NUMBER = 2000
+REPEAT = 5
+
+readings = [(f"field-{i:03d}", 25.5, 60.2, 41.0, 6.8) for i in range(READINGS)]
+
+json_body = json.dumps([
+    {"device_id": device_id, "temperature": temperature, "humidity": humidity,
+     "soil_moisture": soil_moisture, "ph": ph}
+    for device_id, temperature, humidity, soil_moisture, ph in readings
+]).encode()
+
+binary_body = b"".join(
+    SENSOR_FRAME.pack(device_id.encode(), temperature, humidity, soil_moisture, ph)
+    for device_id, temperature, humidity, soil_moisture, ph in readings
+)
+
+
+# What the JSON path does: parse, then pull each required field out
+def parse_json():
+    data = json.loads(json_body)
+    return [
+        (row["device_id"], row["temperature"], row["humidity"], row["soil_moisture"], row["ph"])
+        for row in data
+    ]
+
+
+# What decode_sensor_frames does: unpack records straight out of a memoryview
+def parse_binary():
+    return [
+        (raw_id.rstrip(b"\0").decode("utf-8"), temperature, humidity, soil_moisture, ph)
+        for raw_id, temperature, humidity, soil_moisture, ph in SENSOR_FRAME.iter_unpack(memoryview(binary_body))
+    ]
+
+
+def best_us(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=REPEAT)) / NUMBER * 1e6
+
+
+if __name__ == "__main__":
+    json_us = best_us(parse_json)
+    binary_us = best_us(parse_binary)
+
+    print(f"readings: {READINGS}")
+    print(f"json:   {len(json_body):>8} bytes  {json_us:>9.1f} us/parse")
+    print(f"binary: {len(binary_body):>8} bytes  {binary_us:>9.1f} us/parse")
+    print(f"saved:  {1 - len(binary_body) / len(json_body):>8.0%} bytes  {1 - binary_us / json_us:>9.0%} parse time")
@@ -0,0 +1,69 @@
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import (
+    CREATE_SENSOR_TABLE, CREATE_USERS_TABLE, create_app, ensure_table, execute_prepared, get_connection
+)
+
+
+#   PREPARED STATEMENT BENCHMARK
+
+# Times the hot single-row lookup and insert paths with server-side prepared
+# statements on and off. Needs a reachable DATABASE_URL; rows it adds are
+# deleted at the end. Usage: python bench_prepared.py [calls] > bench_output.txt
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+BENCH_EMAIL = "bench-prepared@example.com"
+BENCH_DEVICE = "bench-prepared"
+
+
+def run(name, params, use_prepared):
+    app.config["USE_PREPARED_STATEMENTS"] = use_prepared
+    connection = get_connection()
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        # One transaction per call, like the request handlers
+        with connection:
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, name, params)
+                cursor.fetchone()
+    return (time.perf_counter() - started) / CALLS * 1e6
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.app_context().push()
+
+    connection = get_connection()
+    ensure_table(CREATE_SENSOR_TABLE)
+    ensure_table(CREATE_USERS_TABLE)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;",
+                (BENCH_EMAIL, BENCH_EMAIL, generate_password_hash("bench")),
+            )
+
+    cases = [
+        ("GET_USER_BY_EMAIL", (BENCH_EMAIL,)),
+        ("INSERT_SENSOR_DATA_RETURN_ID", (BENCH_DEVICE, 25.5, 60.2, 41.0, 6.8)),
+    ]
+    try:
+        print(f"calls per case: {CALLS}")
+        for name, params in cases:
+            # Warm up both paths (and PREPARE) before timing
+            run(name, params, True)
+            run(name, params, False)
+            plain_us = run(name, params, False)
+            prepared_us = run(name, params, True)
+            print(
+                f"{name:<30} plain {plain_us:>7.1f} us  prepared {prepared_us:>7.1f} us"
+                f"  saved {1 - prepared_us / plain_us:>4.0%}"
+            )
+    finally:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM demo WHERE device_id = %s;", (BENCH_DEVICE,))
+                cursor.execute("DELETE FROM users WHERE email = %s;", (BENCH_EMAIL,))